@@ -5,11 +5,15 @@ Written by s0ph0s. https://github.com/vladasbarisas/XBN"""
 
 import os
 import re
+import sys
 import csv
+import json
 import math
+import mmap
 import urwid
 import random
 import signal
+import struct
 import argparse
 import datetime
 import tempfile
@@ -19,6 +23,14 @@ import subprocess
 import mutagen.id3
 import mutagen.mp3
 import configparser
+import multiprocessing
+import concurrent.futures
+
+try:
+    import lameenc
+except ImportError:
+    # Fall back to running the lame executable
+    lameenc = None
 
 # import urllib.parse
 
@@ -36,6 +48,14 @@ REQUIRED_TEXT_KEYS = [
 ]
 # These keys must be in the configuration file, with boolean values
 REQUIRED_BOOL_KEYS = ["write_date", "write_trackno", "lyrics_equals_comment"]
+# The values allowed for the boolean keys
+BOOL_LITERALS = frozenset(("True", "False"))
+# Where a configuration file that passed the checks is cached between runs
+CONFIG_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "postshow.json")
+# Caches written with a different version are ignored.  Bump this whenever the
+# parser settings in check_config or the checks in validate_config change, so
+# that a config that only passed under the old rules gets checked again.
+CONFIG_CACHE_VERSION = 2
 
 
 #
@@ -90,7 +110,13 @@ class Chapter(object):
         if self.url is not None:
             sub_frames.append(mutagen.id3.WXXX(desc="chapter url", url=self.url))
         if self.image is not None:
-            raise NotImplementedError("I haven't done this bit yet.")
+            sub_frames.append(
+                MP3Tagger.picture_frame(
+                    self.image,
+                    picture_type=mutagen.id3.PictureType.OTHER,
+                    desc="chapter image",
+                )
+            )
         return mutagen.id3.CHAP(
             element_id=self.elem_id,
             start_time=self.start,
@@ -102,98 +128,103 @@ class Chapter(object):
 class MP3Tagger:
     """Tag an MP3."""
 
+    # Field names accepted by apply(), and the text frames they are written to
+    _FRAME_MAP = {
+        "title": mutagen.id3.TIT2,
+        "artist": mutagen.id3.TPE1,
+        "album": mutagen.id3.TALB,
+        "season": mutagen.id3.TPOS,
+        "genre": mutagen.id3.TCON,
+        "composer": mutagen.id3.TCOM,
+        "accompaniment": mutagen.id3.TPE2,
+        "date": mutagen.id3.TDRC,
+        "trackno": mutagen.id3.TRCK,
+        "language": mutagen.id3.TLAN,
+    }
+    # Bytes of padding to leave after the tag when the file has to be
+    # rewritten, so that retagging it later can be done in place
+    PADDING = 4096
+
     def __init__(self, path: str):
         """Create a new tagger."""
         self.path = path
+        # Parse the file once, for both the existing tag and the stream info
+        mp3 = mutagen.mp3.MP3(path)
         # Create an ID3 tag if none exists
-        try:
-            self.tag = mutagen.id3.ID3(path)
-        except mutagen.MutagenError:
-            broken = mutagen.id3.ID3FileType(path)
-            broken.add_tags(ID3=mutagen.id3.ID3)
-            self.tag = broken.ID3()
+        if mp3.tags is None:
+            mp3.add_tags()
+        self.tag = mp3.tags
         # Determine the length of the MP3 and write it to a TLEN frame
-        mp3 = mutagen.mp3.MP3(path)
         length = int(round(mp3.info.length * 1000, 0))
-        self.tag.add(mutagen.id3.TLEN(text=str(length)))
+        self.tag["TLEN"] = mutagen.id3.TLEN(text=str(length))
 
-    @staticmethod
-    def _no_padding(arg):
-        return 0
+    @classmethod
+    def _padding(cls, info: mutagen.PaddingInfo) -> int:
+        # Keep the existing padding if the new tag still fits in it, so the
+        # tag is rewritten in place.  Otherwise the whole file has to be
+        # rewritten anyway, so leave some room for the next time.
+        if info.padding >= 0:
+            return info.padding
+        return cls.PADDING
 
     def save(self):
-        """Save the tag."""
-        self.tag.save(self.path, v2_version=3, padding=self._no_padding)
-
-    def set_title(self, title: str) -> None:
-        """Set the title of the MP3."""
-        self.tag.delall("TIT2")
-        self.tag.add(mutagen.id3.TIT2(text=title))
-
-    def set_artist(self, artist: str) -> None:
-        """Set the artist of the MP3."""
-        self.tag.delall("TPE1")
-        self.tag.add(mutagen.id3.TPE1(text=artist))
-
-    def set_album(self, album: str) -> None:
-        """Set the album of the MP3."""
-        self.tag.delall("TALB")
-        self.tag.add(mutagen.id3.TALB(text=album))
-
-    def set_season(self, season: str) -> None:
-        """Set the season of the MP3."""
-        self.tag.delall("TPOS")
-        self.tag.add(mutagen.id3.TPOS(text=season))
-
-    def set_genre(self, genre: str) -> None:
-        """Set the genre of the MP3."""
-        self.tag.delall("TCON")
-        self.tag.add(mutagen.id3.TCON(text=genre))
-
-    def set_composer(self, composer: str) -> None:
-        """Set the composer of the MP3."""
-        self.tag.delall("TCOM")
-        self.tag.add(mutagen.id3.TCOM(text=composer))
-
-    def set_accompaniment(self, accompaniment: str) -> None:
-        """Set the accompaniment of the MP3."""
-        self.tag.delall("TPE2")
-        self.tag.add(mutagen.id3.TPE2(text=accompaniment))
+        """Save the tag as ID3v2.3, for players that don't read v2.4."""
+        # Only saving with v2_version=3 would leave v2.4-only frames such as
+        # TDRC in the tag, which v2.3 readers ignore.  This converts them
+        # (TDRC becomes TYER, and so on) and drops any that have no v2.3
+        # equivalent.
+        self.tag.update_to_v23()
+        self.tag.save(self.path, v2_version=3, padding=self._padding)
+
+    def apply(self, fields: dict) -> None:
+        """Set the text frames of the MP3 in one go.
+
+        :param fields: Maps the field names in ``_FRAME_MAP`` (title, artist,
+        date, etc.) to their values.  Existing frames for those fields are
+        replaced.
+        """
+        frames = {
+            key: self._FRAME_MAP[key](text=value) for key, value in fields.items()
+        }
+        # A text frame's HashKey is just its FrameID, so assigning to it
+        # replaces the old frame without the scan over every frame that
+        # delall does.  Frames with a description or language in their
+        # HashKey (COMM, USLT, CHAP, APIC, etc.) still go through add().
+        for frame in frames.values():
+            self.tag[frame.HashKey] = frame
 
     def set_cover_art(self, path: str):
         """Set the cover art of the MP3."""
         self.tag.delall("APIC")
+        self.tag.add(self.cover_art_frame(path))
+
+    @staticmethod
+    def cover_art_frame(path: str) -> mutagen.id3.APIC:
+        """Read an image file into an APIC frame for use as cover art."""
+        return MP3Tagger.picture_frame(
+            path,
+            picture_type=mutagen.id3.PictureType.COVER_FRONT,
+            desc="podcast cover art",
+        )
+
+    @staticmethod
+    def picture_frame(path: str, picture_type: int, desc: str) -> mutagen.id3.APIC:
+        """Read an image file into an APIC frame.
+
+        :param path: The path to the image file.
+        :param picture_type: The ``mutagen.id3.PictureType`` of the image.
+        :param desc: A description of the image.
+        """
         mime, ignored = mimetypes.guess_type(path)
         if mime is None:
-            raise PostShowError("Unable to guess MIME type of cover image.")
+            raise PostShowError("Unable to guess MIME type of {}.".format(path))
         data = None
         try:
             with open(path, "rb") as fp:
                 data = fp.read()
         except IOError:
-            raise PostShowError("Unable to read cover image file.")
-        apic = mutagen.id3.APIC(
-            mime=mime,
-            type=mutagen.id3.PictureType.COVER_FRONT,
-            desc="podcast cover art",
-            data=data,
-        )
-        self.tag.add(apic)
-
-    def set_date(self, year: str) -> None:
-        """Set the date of recording of the MP3."""
-        self.tag.delall("TDRC")
-        self.tag.add(mutagen.id3.TDRC(text=[mutagen.id3.ID3TimeStamp(year)]))
-
-    def set_trackno(self, trackno: str) -> None:
-        """Set the track number of the MP3."""
-        self.tag.delall("TRCK")
-        self.tag.add(mutagen.id3.TRCK(text=trackno))
-
-    def set_language(self, language: str) -> None:
-        """Set the language of the MP3."""
-        self.tag.delall("TLAN")
-        self.tag.add(mutagen.id3.TLAN(text=language))
+            raise PostShowError("Unable to read image file {}.".format(path))
+        return mutagen.id3.APIC(mime=mime, type=picture_type, desc=desc, data=data)
 
     def add_comment(self, lang: str, desc: str, comment: str) -> None:
         """Add a comment to the MP3."""
@@ -209,12 +240,19 @@ class MP3Tagger:
 
     def add_chapters(self, chapters: list):
         """Add a whole list of chapters to the MP3."""
-        child_element_ids = []
-        for chapter in chapters:
-            self.add_chapter(chapter)
-            if chapter.indexed:
-                child_element_ids.append(chapter.elem_id)
-        self.tag.add(
+        self.add_frames(self.chapter_frames(chapters))
+
+    @staticmethod
+    def chapter_frames(chapters: list) -> list:
+        """Convert a list of chapters into CHAP frames and a CTOC frame.
+
+        Chapters can have images, so they are converted in parallel to keep
+        the disk busy.
+        """
+        with concurrent.futures.ThreadPoolExecutor(os.cpu_count()) as ex:
+            frames = list(ex.map(Chapter.as_chap, chapters))
+        child_element_ids = [chapter.elem_id for chapter in chapters if chapter.indexed]
+        frames.append(
             mutagen.id3.CTOC(
                 element_id="toc",
                 flags=mutagen.id3.CTOCFlags.TOP_LEVEL | mutagen.id3.CTOCFlags.ORDERED,
@@ -222,58 +260,392 @@ class MP3Tagger:
                 sub_frames=[mutagen.id3.TIT2(text="Primary Chapter List")],
             )
         )
+        return frames
+
+    def add_frames(self, frames: list):
+        """Add a list of prebuilt frames to the MP3."""
+        for frame in frames:
+            self.tag.add(frame)
 
 
 class MP3Encoder(threading.Thread):
-    """Shell out to LAME to encode the WAV file as an MP3."""
+    """Shell out to LAME to encode the WAV file as an MP3.
+
+    The PCM data is piped into LAME from a memory map of the WAV file.  If
+    the ``lameenc`` module is installed, the encoding is done in this process
+    with it instead, which saves starting LAME and copying everything through
+    a pipe.
+
+    LAME itself only uses one core, so the PCM data can optionally be split
+    into several shards that are encoded at the same time and concatenated.
+    This is not the default, because every shard gets its own encoder delay
+    and flush padding: each boundary adds a frame or two of silence, which
+    can be heard as a gap and pushes later chapter marks off.
+    """
+
+    # Samples per MPEG-1 Layer III frame.  Shard boundaries are aligned to
+    # this so that no shard ends with a partial frame of padding.
+    FRAME_SAMPLES = 1152
+    # Number of bytes written to a LAME process at a time, which is also the
+    # granularity of the progress reporting.
+    WRITE_BLOCK = 1024 * 1024
+    # Bytes read at the start of a WAV file to find its fmt and data chunks
+    HEADER_READ = 4096
+    # The last 14 bytes of every WAVE_FORMAT_EXTENSIBLE SubFormat GUID
+    SUBFORMAT_GUID_TAIL = bytes.fromhex("000000001000800000aa00389b71")
+    # Seconds to let LAME exit on its own after a stop request before it is
+    # killed.
+    STOP_GRACE_SECONDS = 2
+    # In an encode_batch worker: the event that stops the batch, and the
+    # encoder that is currently running
+    _batch_stop = None
+    _batch_encoder = None
 
     def __init__(self):
         super().__init__()
         self.infile = None
         self.outfile = None
         self.bitrate = None
-        self.matcher = None
-        self.p = None
+        self.wav_info = None
+        self.jobs = None
+        self.processes = []
+        self.fed = []
+        self.total = 0
         self.percent = 0
         self.started = False
+        self.stop_requested = threading.Event()
         self.finished = False
+        self.error = None
 
-    def setup(self, infile: str, outfile: str, bitrate: str):
+    def setup(self, infile: str, outfile: str, bitrate: str, wav_info=None, jobs=None):
         """Configure the input and output files, and the encoder bitrate.
 
         :param infile: Path to WAV file.
         :param outfile: Path to create MP3 file at.
         :param bitrate: LAME CBR bitrate, in Kbps.
+        :param wav_info: The result of ``read_wav_header(infile)``, if the
+        caller already has it.
+        :param jobs: Number of shards to split the audio into and encode at
+        the same time.  Defaults to 1, since every extra shard adds a short
+        gap to the audio (see the class documentation).
         """
         self.infile = infile
         self.outfile = outfile
         self.bitrate = bitrate
-        self.matcher = re.compile(r"\(([0-9]?[0-9 ][0-9])%\)")
+        self.wav_info = wav_info
+        self.jobs = jobs if jobs is not None else 1
+
+    @staticmethod
+    def read_wav_header(path: str) -> tuple:
+        """Read the format of a PCM WAV file and find its sample data.
+
+        Returns a ``(sample_rate, channels, sample_width, data_offset,
+        data_bytes)`` tuple, with the sample width in bytes.
+        """
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            # The headers almost always fit in the first read, even with JUNK,
+            # LIST or bext chunks before the sample data.
+            head = os.read(fd, MP3Encoder.HEADER_READ)
+
+            def read_at(offset: int, size: int) -> bytes:
+                if offset + size <= len(head):
+                    return head[offset : offset + size]
+                os.lseek(fd, offset, os.SEEK_SET)
+                return os.read(fd, size)
+
+            if len(head) < 12 or head[0:4] != b"RIFF" or head[8:12] != b"WAVE":
+                raise PostShowError("{} is not a WAV file".format(path))
+            fmt = None
+            offset = 12
+            while True:
+                header = read_at(offset, 8)
+                if len(header) < 8:
+                    raise PostShowError("{} has no data chunk".format(path))
+                chunk_id, chunk_size = struct.unpack_from("<4sI", header)
+                offset += 8
+                if chunk_id == b"fmt ":
+                    # Up to the end of the WAVE_FORMAT_EXTENSIBLE SubFormat
+                    fmt = read_at(offset, min(chunk_size, 40))
+                elif chunk_id == b"data":
+                    break
+                offset += chunk_size + (chunk_size & 1)
+            if fmt is None or len(fmt) < 16:
+                raise PostShowError("{} has no format chunk".format(path))
+            # Don't trust the size of the data chunk past the end of the file,
+            # since some programs write it before they know the real length.
+            length = min(chunk_size, os.fstat(fd).st_size - offset)
+        finally:
+            os.close(fd)
+        fmt_tag, channels, rate, _, block_align, _ = struct.unpack_from("<HHIIHH", fmt)
+        if fmt_tag == 0xFFFE and len(fmt) >= 40:
+            # WAVE_FORMAT_EXTENSIBLE keeps the real format in the first two
+            # bytes of the SubFormat GUID; the rest is the same for all of them
+            if fmt[26:40] == MP3Encoder.SUBFORMAT_GUID_TAIL:
+                fmt_tag = struct.unpack_from("<H", fmt, 24)[0]
+        # Anything else (floating point, compressed) would be read as integer
+        # PCM and come out as noise
+        if fmt_tag != 1 or channels == 0 or not 1 <= block_align // channels <= 4:
+            raise PostShowError("{} does not contain integer PCM audio".format(path))
+        width = block_align // channels
+        # Only whole sample frames can be encoded
+        length -= length % block_align
+        return rate, channels, width, offset, length
+
+    def _shard_bounds(self, offset: int, length: int, block_align: int) -> list:
+        """Split the PCM data into (start, end) byte ranges, one per job."""
+        frame_bytes = self.FRAME_SAMPLES * block_align
+        frames = math.ceil(length / frame_bytes)
+        shard_bytes = max(1, math.ceil(frames / self.jobs)) * frame_bytes
+        end = offset + length
+        return [
+            (start, min(start + shard_bytes, end))
+            for start in range(offset, end, shard_bytes)
+        ]
+
+    def _lame_command(self, rate: int, channels: int, width: int) -> list:
+        """Build the LAME command line for raw PCM on stdin, MP3 on stdout."""
+        # -t stops LAME from writing a Xing/LAME info frame at the start of
+        # each shard, which would otherwise end up in the middle of the file.
+        command = ["lame", "-r", "-s", str(rate / 1000), "--bitwidth"]
+        command.extend([str(width * 8), "-m", "m" if channels == 1 else "j"])
+        if width == 1:
+            # 8-bit WAV is unsigned, unlike every other width
+            command.append("--unsigned")
+        command.extend(["-t", "-b", self.bitrate, "--cbr", "--silent", "-", "-"])
+        return command
+
+    def _feed(self, index: int, mm: mmap.mmap, start: int, end: int):
+        """Write one shard of PCM data to the stdin of its LAME process."""
+        stdin = self.processes[index].stdin
+        # Writing slices of a memoryview hands the mapped pages straight to
+        # the pipe, instead of copying each block into a bytes object first.
+        try:
+            with memoryview(mm) as view:
+                for pos in range(start, end, self.WRITE_BLOCK):
+                    if self.stop_requested.is_set():
+                        break
+                    block_end = min(pos + self.WRITE_BLOCK, end)
+                    stdin.write(view[pos:block_end])
+                    self.fed[index] += block_end - pos
+                    self.percent = sum(self.fed) * 100 // self.total
+        except BrokenPipeError:
+            # LAME went away, either because request_stop killed it or
+            # because it failed, which _drain reports.
+            pass
+        finally:
+            # Always close stdin, or LAME waits for more input forever and
+            # _drain never returns.
+            try:
+                stdin.close()
+            except BrokenPipeError:
+                pass
+        self._release(mm, start, end)
+
+    @staticmethod
+    def _release(mm: mmap.mmap, start: int, end: int):
+        """Tell the kernel a shard of the mapped WAV won't be read again."""
+        if not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        # madvise needs a page-aligned start.  Round up rather than down, so
+        # that the tail of the previous shard is left alone.
+        start = -(-start // mmap.PAGESIZE) * mmap.PAGESIZE
+        if start < end:
+            mm.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def _drain(self, index: int) -> bytes:
+        """Read all of the MP3 data a LAME process produces."""
+        p = self.processes[index]
+        data = p.stdout.read()
+        # With --silent LAME only writes errors to stderr, which are far too
+        # short to fill the pipe while stdout is being read.
+        errors = p.stderr.read()
+        if p.wait() != 0 and not self.stop_requested.is_set():
+            message = errors.decode(errors="replace").strip()
+            raise PostShowError(
+                "LAME exited with status {}: {}".format(p.returncode, message)
+            )
+        return data
+
+    def _encode(self, index: int, mm: mmap.mmap, start: int, end: int, fmt):
+        """Encode one shard of PCM data with lameenc."""
+        rate, channels = fmt
+        enc = lameenc.Encoder()
+        enc.set_bit_rate(int(self.bitrate))
+        enc.set_in_sample_rate(rate)
+        enc.set_channels(channels)
+        enc.set_quality(3)
+        parts = []
+        for pos in range(start, end, self.WRITE_BLOCK):
+            if self.stop_requested.is_set():
+                break
+            block_end = min(pos + self.WRITE_BLOCK, end)
+            parts.append(enc.encode(mm[pos:block_end]))
+            self.fed[index] += block_end - pos
+            self.percent = sum(self.fed) * 100 // self.total
+        parts.append(enc.flush())
+        self._release(mm, start, end)
+        return b"".join(parts)
+
+    def _run_lameenc(self, mm: mmap.mmap, bounds: list, fmt) -> list:
+        """Encode every shard in this process, one thread per shard."""
+        with concurrent.futures.ThreadPoolExecutor(len(bounds) or 1) as ex:
+            parts = [
+                ex.submit(self._encode, i, mm, start, end, fmt)
+                for i, (start, end) in enumerate(bounds)
+            ]
+            return [part.result() for part in parts]
+
+    def _run_lame(self, mm: mmap.mmap, bounds: list, command: list) -> list:
+        """Encode every shard with its own LAME process."""
+        self.processes = [
+            # Keep LAME out of the terminal's process group, so that Ctrl-C
+            # is handled by request_stop instead of killing it mid-frame.
+            subprocess.Popen(
+                command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=True,
+            )
+            for _ in bounds
+        ]
+        # One writer and one reader per process, so that a full stdout
+        # pipe can never stall the writer feeding that process.
+        with concurrent.futures.ThreadPoolExecutor(2 * len(bounds) or 1) as ex:
+            writers = [
+                ex.submit(self._feed, i, mm, start, end)
+                for i, (start, end) in enumerate(bounds)
+            ]
+            parts = [ex.submit(self._drain, i) for i in range(len(bounds))]
+            # Collect the writers too, so that their exceptions are raised
+            for writer in writers:
+                writer.result()
+            return [part.result() for part in parts]
 
     def run(self):
         self.started = True
-        self.p = subprocess.Popen(
-            ["lame", "-t", "-b", self.bitrate, "--cbr", self.infile, self.outfile],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.PIPE,
-        )
-        for block in iter(lambda: self.p.stderr.read(1024), ""):
-            # Stop when the process terminates.
-            if self.p.poll() is not None:
-                break
-            text = block.decode("utf-8")
-            groups = self.matcher.findall(text)
-            if len(groups) < 1:
-                continue
-            percent = int(groups[-1])
-            self.percent = percent
-            if percent == 100 and self.p.poll() is not None:
-                break
-        self.finished = True
+        try:
+            self.encode()
+        except Exception as e:
+            # An exception can't cross threads, so keep it for whoever joins
+            # this one
+            self.error = e
+        finally:
+            self.finished = True
+
+    def encode(self):
+        """Encode the WAV file on the calling thread, raising any errors."""
+        if self.wav_info is None:
+            self.wav_info = self.read_wav_header(self.infile)
+        rate, channels, width, offset, self.total = self.wav_info
+        with open(self.infile, "rb") as fp:
+            mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            # Every shard is read front to back, so read ahead generously
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        bounds = self._shard_bounds(offset, self.total, channels * width)
+        self.fed = [0] * len(bounds)
+        # lameenc only accepts 16-bit samples
+        if lameenc is not None and width == 2:
+            parts = self._run_lameenc(mm, bounds, (rate, channels))
+        else:
+            command = self._lame_command(rate, channels, width)
+            parts = self._run_lame(mm, bounds, command)
+        mm.close()
+        if not self.stop_requested.is_set():
+            with open(self.outfile, "wb") as out:
+                for part in parts:
+                    out.write(part)
 
     def request_stop(self):
-        if self.started and self.p is not None:
-            self.p.terminate()
+        """Ask the encoder to stop, without waiting for it to do so.
+
+        This is safe to call from a signal handler.  Running LAME processes
+        are sent SIGTERM straight away, and killed if they are still running
+        ``STOP_GRACE_SECONDS`` later.
+        """
+        self.stop_requested.set()
+        if self.started:
+            for p in self.processes:
+                if p.poll() is None:
+                    p.terminate()
+            killer = threading.Timer(self.STOP_GRACE_SECONDS, self._kill)
+            killer.daemon = True
+            killer.start()
+
+    def _kill(self):
+        """Kill any LAME processes that didn't exit after request_stop."""
+        for p in self.processes:
+            if p.poll() is None:
+                p.kill()
+
+    @staticmethod
+    def _init_batch_worker(stop) -> None:
+        """Set up an ``encode_batch`` worker process.
+
+        Ctrl-C is ignored here, since the worker would otherwise turn it into
+        the result of whatever job it is on and carry on with the next one.
+        Instead, the parent sets ``stop``, and a thread in each worker stops
+        the encoder that is running and any that would start afterwards.
+        """
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        MP3Encoder._batch_stop = stop
+
+        def watch():
+            stop.wait()
+            if MP3Encoder._batch_encoder is not None:
+                MP3Encoder._batch_encoder.request_stop()
+
+        threading.Thread(target=watch, daemon=True).start()
+
+    @staticmethod
+    def encode_one(infile: str, outfile: str, bitrate: str) -> None:
+        """Encode one WAV file on the calling thread, without sharding it.
+
+        This is for ``encode_batch``, where the files themselves are already
+        being encoded in parallel.
+        """
+        encoder = MP3Encoder()
+        encoder.setup(infile, outfile, bitrate, jobs=1)
+        MP3Encoder._batch_encoder = encoder
+        try:
+            # Checked after publishing the encoder, so that a stop can't slip
+            # in between without either this or the watcher seeing it
+            if MP3Encoder._batch_stop is not None and MP3Encoder._batch_stop.is_set():
+                return
+            encoder.encode()
+        finally:
+            MP3Encoder._batch_encoder = None
+
+    @staticmethod
+    def encode_batch(jobs: list) -> None:
+        """Encode several WAV files, with at most one per CPU core at a time.
+
+        :param jobs: A list of ``(infile, outfile, bitrate)`` tuples, with the
+        same meanings as the arguments to ``setup``.
+        """
+        if len(jobs) == 0:
+            return
+        workers = min(len(jobs), os.cpu_count() or 1)
+        stop = multiprocessing.Event()
+        ex = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=MP3Encoder._init_batch_worker,
+            initargs=(stop,),
+        )
+        try:
+            # Consume the results so that exceptions from workers are raised
+            list(ex.map(MP3Encoder.encode_one, *zip(*jobs)))
+        except BaseException:
+            # A file failed or Ctrl-C was pressed: stop the files being
+            # encoded, and skip the ones already queued to the workers, which
+            # cancel_futures can no longer reach
+            stop.set()
+            raise
+        finally:
+            # Don't start any of the files still waiting in the queue
+            ex.shutdown(cancel_futures=True)
 
 
 class EpisodeMetadata(object):
@@ -908,6 +1280,9 @@ class Controller:
     6. Display the ``TaggerProgress`` view
     7. Save the tags to the file, which will lock up the UI ( threading :( )
     8. Exit
+
+    When stdin isn't a terminal, ``run_piped`` does the same steps without
+    any of the views.
     """
 
     def __init__(self, args, config):
@@ -929,6 +1304,8 @@ class Controller:
         self.mp3_path = None
         self.chapters = None
         self.tmp_path = None
+        self.wav_info = None
+        self.tags = None
 
     @staticmethod
     def get_palette():
@@ -953,21 +1330,30 @@ class Controller:
         1. Start the encoder in a separate thread
         2. Display the ``EnterBasics`` view
         """
+        self.start_encoder()
+        basics_view = EnterBasics(self)
+        self.loop.widget = basics_view.get_view()
+
+    def start_encoder(self):
+        """Start the encoder in a separate thread, unless it isn't needed."""
         # Encode the mp3 to a temp file first, then move it later
         self.tmp_path = tempfile.TemporaryDirectory()
         if not self.args.no_encode:
             self.mp3_path = self.build_output_file_path(
                 "mp3", parent=self.tmp_path.name
             )
+            # Read the WAV header here so a bad file is reported right away,
+            # instead of being lost on the encoder thread
+            self.wav_info = MP3Encoder.read_wav_header(self.args.wav)
             self.encoder.setup(
                 self.args.wav,
                 self.mp3_path,
                 self.config.get(self.args.profile, "bitrate"),
+                self.wav_info,
+                self.args.jobs,
             )
             # Start the encoder on its own thread
             self.encoder.start()
-        basics_view = EnterBasics(self)
-        self.loop.widget = basics_view.get_view()
 
     def set_metadata(self, metadata: EpisodeMetadata):
         """Do steps 3 and 4.
@@ -990,12 +1376,53 @@ class Controller:
         5. Display the ``EncoderProgress`` view
         """
         self.metadata = metadata
+        self.start_tag_builder()
         if not self.args.no_encode:
             progress_view = EncoderProgress(self)
             self.loop.widget = progress_view.get_view()
         else:
             self.progress_view_finished()
 
+    def start_tag_builder(self):
+        """Build the tag contents on another thread.
+
+        This includes reading the cover art, and happens while the encoder
+        is still running instead of after it finishes.
+        """
+        builder = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.tags = builder.submit(self.build_tags)
+        builder.shutdown(wait=False)
+
+    def run_piped(self, text: str):
+        """Run the whole process without the UI, for when stdin isn't a TTY.
+
+        :param text: Everything read from stdin.  This is the episode number,
+        episode name and (optionally) the comment, separated by lines
+        containing only ``--``.
+        """
+        number, name, comment = (text.split("\n--\n", 2) + ["", ""])[:3]
+        number = number.strip()
+        name = name.strip()
+        # Both end up in file names and single-line tags, so catch input that
+        # is missing the separators before anything gets written.
+        for label, value in (("episode number", number), ("episode name", name)):
+            if value == "" or "\n" in value or "\r" in value:
+                raise PostShowError(
+                    "The {} read from stdin must be a single non-empty line. "
+                    "Separate the number, name and comment with lines "
+                    'containing only "--".'.format(label)
+                )
+        self.start_encoder()
+        self.metadata = EpisodeMetadata(number, name)
+        self.complete_metadata()
+        if self.args.markers is not None:
+            self.build_chapters()
+        if comment.strip() != "":
+            self.metadata.comment = "\r\n".join(comment.strip().splitlines())
+        self.start_tag_builder()
+        self.finish_encoder()
+        self.write_tags()
+
     def exit(self):
         if self.encoder is not None and self.encoder.started:
             print("Waiting for the encoder to stop...")
@@ -1033,37 +1460,82 @@ class Controller:
         mcs.save(self.build_output_file_path("txt"), MCS.SIMPLE)
         self.metadata.lyrics = "\n".join([chapter.text for chapter in self.chapters])
 
-    def do_tag(self, loop, user_data):
-        """Tag the file, and do step 8.
+    def build_tags(self) -> tuple:
+        """Build all of the ID3 tag contents for the episode.
 
-        8. Exit
+        None of this needs the encoded file, so it is run on another thread
+        while the encoder is busy.  Returns a ``(fields, frames)`` tuple,
+        where ``fields`` is for ``MP3Tagger.apply`` and ``frames`` is a list
+        of the remaining frames for ``MP3Tagger.add_frames``.
         """
-        t = MP3Tagger(self.mp3_path)
-        t.set_title(self.metadata.title)
-        t.set_album(self.metadata.album)
-        t.set_artist(self.metadata.artist)
-        t.set_season(self.metadata.season)
-        t.set_genre(self.metadata.genre)
-        t.set_language(self.metadata.language)
+        language = self.metadata.language
+        fields = {
+            "title": self.metadata.title,
+            "album": self.metadata.album,
+            "artist": self.metadata.artist,
+            "season": self.metadata.season,
+            "genre": self.metadata.genre,
+            "language": language,
+        }
+        frames = []
         if self.metadata.composer is not None:
-            t.set_composer(self.metadata.composer)
+            fields["composer"] = self.metadata.composer
         if self.metadata.accompaniment is not None:
-            t.set_accompaniment(self.metadata.accompaniment)
+            fields["accompaniment"] = self.metadata.accompaniment
+        if self.metadata.comment is not None and self.metadata.comment != "":
+            frames.append(
+                mutagen.id3.COMM(
+                    lang=language, desc="track list", text=[self.metadata.comment]
+                )
+            )
         if self.metadata.lyrics is not None and self.metadata.lyrics != "":
-            t.add_comment(self.metadata.language, "track list", self.metadata.comment)
-            if self.metadata.comment is not None:
-                t.add_lyrics(self.metadata.language, "track list", self.metadata.lyrics)
+            frames.append(
+                mutagen.id3.USLT(
+                    lang=language, desc="track list", text=self.metadata.lyrics
+                )
+            )
         if self.config.getboolean(self.args.profile, "write_date"):
-            t.set_date(datetime.datetime.now().strftime("%Y"))
+            fields["date"] = datetime.datetime.now().strftime("%Y")
         if self.config.getboolean(self.args.profile, "write_trackno"):
-            t.set_trackno(self.metadata.track)
+            fields["trackno"] = self.metadata.track
         if self.chapters is not None:
-            t.add_chapters(self.chapters)
-        if "cover_art" in self.config[self.args.profile].keys():
-            t.set_cover_art(self.config.get(self.args.profile, "cover_art"))
-        t.save()
+            frames.extend(MP3Tagger.chapter_frames(self.chapters))
+        if "cover_art" in self.config[self.args.profile]:
+            frames.append(
+                MP3Tagger.cover_art_frame(
+                    self.config.get(self.args.profile, "cover_art")
+                )
+            )
+        return fields, frames
+
+    def do_tag(self, loop, user_data):
+        """Tag the file, and do step 8.
+
+        8. Exit
+        """
+        self.write_tags()
         raise urwid.ExitMainLoop()
 
+    def write_tags(self):
+        """Write the tags built by ``build_tags`` to the final MP3."""
+        fields, frames = self.tags.result()
+        # Where supported, have the kernel start reading the MP3 in before
+        # mutagen gets to it, and drop it from the page cache once it's
+        # written, since nothing in this program will read it again.
+        advise = hasattr(os, "posix_fadvise")
+        fd = os.open(self.mp3_path, os.O_RDONLY)
+        try:
+            if advise:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            t = MP3Tagger(self.mp3_path)
+            t.apply(fields)
+            t.add_frames(frames)
+            t.save()
+            if advise:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
     def set_alarm_in(self, *args, **kwargs):
         """Pass the call to the event loop."""
         self.loop.set_alarm_in(*args, **kwargs)
@@ -1077,21 +1549,31 @@ class Controller:
         This method is supposed to be called by the EncoderProgress view
         after it finishes.
         """
+        self.finish_encoder()
+        tag_progress_view = TaggerProgress(self)
+        self.loop.widget = tag_progress_view.get_view()
+        # Do async so that this function returns immediately
+        self.loop.set_alarm_in(0.1, self.do_tag)
+
+    def finish_encoder(self):
+        """Wait for the encoder and move the MP3 to the output directory."""
         # This isn't inside the if so that do_tag doesn't fail
         self.mp3_path = self.build_output_file_path("mp3")
         # Join the encoder thread, since tagging can't occur until it is
         # done
         if not self.args.no_encode:
             self.encoder.join()
+            if self.encoder.error is not None:
+                self.tmp_path.cleanup()
+                raise self.encoder.error
+            if self.encoder.stop_requested.is_set():
+                self.tmp_path.cleanup()
+                raise PostShowError("Encoding was stopped before it finished.")
             os.rename(
                 self.build_output_file_path("mp3", parent=self.tmp_path.name),
                 self.mp3_path,
             )
             self.tmp_path.cleanup()
-        tag_progress_view = TaggerProgress(self)
-        self.loop.widget = tag_progress_view.get_view()
-        # Do async so that this function returns immediately
-        self.loop.set_alarm_in(0.1, self.do_tag)
 
     def encoder_finished(self) -> bool:
         """Return true if the encoder is finished."""
@@ -1143,7 +1625,11 @@ class Main:
     def parse_args() -> argparse.Namespace:
         """Parse arguments to this program."""
         parser = argparse.ArgumentParser(
-            description="Convert and tag WAVs and chapter metadata for podcasts."
+            description="Convert and tag WAVs and chapter metadata for podcasts.",
+            epilog="If stdin is not a terminal, the episode details are read "
+            "from it instead of being asked for: the episode number, a line "
+            'containing only "--", the episode name, and optionally another '
+            '"--" line followed by the comment.',
         )
         parser.add_argument("wav", help="WAV file to convert/use")
         parser.add_argument(
@@ -1175,19 +1661,31 @@ class Main:
             action="store_true",
             help="the MP3 file already exists, don't encode the WAV file.",
         )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=1,
+            help="split the WAV file into this many parts and encode them at "
+            "the same time. Faster, but adds a short gap to the audio at each "
+            "split, so leave this at 1 (the default) unless speed matters more.",
+        )
         args = parser.parse_args()
-        errors = []
-        if not os.path.exists(args.config):
-            errors.append("Configuration file ({}) does not exist".format(args.config))
-        if not os.path.exists(args.wav):
-            errors.append("Source WAV file ({}) does not exist".format(args.wav))
-        if args.markers is not None and not os.path.exists(args.markers):
-            errors.append("Markers file ({}) does not exist".format(args.markers))
+        inputs = (
+            ("Configuration file", args.config),
+            ("Source WAV file", args.wav),
+            ("Markers file", args.markers),
+        )
+        errors = [
+            "{} ({}) does not exist".format(label, path)
+            for label, path in inputs
+            if path is not None and not os.path.exists(path)
+        ]
+        if args.jobs < 1:
+            errors.append("--jobs must be at least 1")
         try:
-            os.mkdir(args.outdir)
-        except FileExistsError:
-            # We don't care, that's fine
-            pass
+            # An existing directory is fine, but an existing file is not
+            os.makedirs(args.outdir, exist_ok=True)
         except OSError as e:
             errors.append(str(e))
         if len(errors) > 0:
@@ -1196,20 +1694,41 @@ class Main:
 
     @staticmethod
     def check_config(path: str) -> configparser.ConfigParser:
-        """Load the config file and check it for correctness."""
-        config = configparser.ConfigParser()
-        config.read(path)
+        """Load the config file and check it for correctness.
+
+        Once a config file has passed the checks, its contents are cached in
+        ``CONFIG_CACHE``, and later runs use that until the file is modified.
+        """
+        mtime = os.stat(path).st_mtime_ns
+        # No section is special, so every profile has to list all of the
+        # required keys itself instead of silently inheriting them from
+        # [DEFAULT].  Values are used literally, without %-interpolation.
+        config = configparser.ConfigParser(
+            interpolation=None, default_section="__DEFAULT__"
+        )
+        sections = Main.read_config_cache(path, mtime)
+        if sections is not None:
+            config.read_dict(sections)
+        else:
+            config.read(path)
+            Main.validate_config(config)
+            Main.write_config_cache(path, mtime, config)
+        for section in config.sections():
+            so = config[section]
+            if "cover_art" in so:
+                so["cover_art"] = os.path.expandvars(so["cover_art"])
+        return config
+
+    @staticmethod
+    def validate_config(config: configparser.ConfigParser) -> None:
+        """Check that every section of the config has the required keys."""
         errors = []
-        # Check every section of the config file, except for DEFAULT (which we
-        # don't care about)
-        for section in config:
-            if section == "DEFAULT":
-                continue
+        for section in config.sections():
             so = config[section]
             # Just verify that the REQUIRED_TEXT_KEYS from above exist in the
             # file.  If they're just empty strings, that's the user's problem.
             for key in REQUIRED_TEXT_KEYS:
-                if key not in so.keys():
+                if key not in so:
                     errors.append(
                         "[{section}] is missing the required key"
                         ' "{key}"'.format(section=section, key=key)
@@ -1217,29 +1736,86 @@ class Main:
             # Verify that the REQUIRED_BOOL_KEYS from above exist in the file,
             # and are boolean values.
             for key in REQUIRED_BOOL_KEYS:
-                if key not in so.keys():
+                if key not in so:
                     errors.append(
                         "[{section}] is missing the required key"
                         ' "{key}"'.format(section=section, key=key)
                     )
                 else:
-                    if so[key] not in ["True", "False"]:
+                    if so[key] not in BOOL_LITERALS:
                         errors.append(
                             "[{section}] must use Python boolean "
                             'values ("True" or "False") for the key '
                             '"{key}"'.format(section=section, key=key)
                         )
-            if "cover_art" in so.keys():
-                so["cover_art"] = os.path.expandvars(so["cover_art"])
         if len(errors) > 0:
             raise PostShowError(";\n".join(errors))
-        return config
+
+    @staticmethod
+    def read_config_cache(path: str, mtime: int):
+        """Return the cached sections for the config file, if still valid.
+
+        Returns None if there is no cache, or it was written under different
+        validation rules, or for a different file or an older version of
+        this one.
+        """
+        try:
+            with open(CONFIG_CACHE, "r", encoding="utf-8") as fp:
+                cache = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        # Anything could have been written to the file, so check its shape
+        # before trusting it
+        if not isinstance(cache, dict):
+            return None
+        sections = cache.get("sections")
+        if (
+            cache.get("version") != CONFIG_CACHE_VERSION
+            or cache.get("path") != os.path.abspath(path)
+            or cache.get("mtime") != mtime
+            or not isinstance(sections, dict)
+            or not all(
+                isinstance(values, dict)
+                and all(isinstance(value, str) for value in values.values())
+                for values in sections.values()
+            )
+        ):
+            return None
+        return sections
+
+    @staticmethod
+    def write_config_cache(path: str, mtime: int, config: configparser.ConfigParser):
+        """Cache the sections of a config file that passed the checks."""
+        # Raw values, so that they can be read back in with read_dict
+        sections = {
+            section: {
+                key: config.get(section, key, raw=True) for key in config[section]
+            }
+            for section in config.sections()
+        }
+        cache = {
+            "version": CONFIG_CACHE_VERSION,
+            "path": os.path.abspath(path),
+            "mtime": mtime,
+            "sections": sections,
+        }
+        try:
+            os.makedirs(os.path.dirname(CONFIG_CACHE), exist_ok=True)
+            with open(CONFIG_CACHE, "w", encoding="utf-8") as fp:
+                json.dump(cache, fp)
+        except OSError:
+            # The cache is only an optimization
+            pass
 
     def main(self):
         """Kickstart the application."""
         c = Controller(self.args, self.config)
-        c.start()
-        c.loop.run()
+        if sys.stdin.isatty():
+            c.start()
+            c.loop.run()
+        else:
+            # Being driven by a script, so there's no one to click buttons
+            c.run_piped(sys.stdin.read())
 
 
 if __name__ == "__main__":
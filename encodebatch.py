@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Encode several WAV files to MP3 at once.
+"""
+
+from PostShowV2 import MP3Encoder
+import argparse
+import os
+import sys
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="Encode WAV files as MP3s.")
+    parser.add_argument("wav", nargs="+", help="the WAV files to encode.")
+    parser.add_argument(
+        "outdir",
+        help="directory in which to write the MP3 files. Will be created if "
+        "nonexistent.",
+    )
+    parser.add_argument(
+        "-b", "--bitrate", default="128", help="LAME CBR bitrate, in Kbps."
+    )
+    namespace = parser.parse_args()
+    jobs = []
+    sources = {}
+    for wav in namespace.wav:
+        name = os.path.splitext(os.path.basename(wav))[0] + ".mp3"
+        # Every MP3 goes in the same directory, so WAVs with the same name
+        # would overwrite each other
+        if name in sources:
+            parser.error(
+                "{} and {} would both be encoded to {}".format(sources[name], wav, name)
+            )
+        sources[name] = wav
+        jobs.append((wav, os.path.join(namespace.outdir, name), namespace.bitrate))
+    os.makedirs(namespace.outdir, exist_ok=True)
+    MP3Encoder.encode_batch(jobs)
+
+
+if __name__ == "__main__":
+    main(sys.argv)